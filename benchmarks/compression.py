@@ -0,0 +1,126 @@
+"""
+Compares request/response sizes and latency with and without compression
+over a throttled local link.
+
+python -m benchmarks.compression [--bandwidth KBYTES_PER_SEC] [--tasks N] [--html-size KBYTES]
+"""
+import argparse
+import gzip
+import http.server
+import json
+import random
+import threading
+import time
+import zlib
+
+from email_devino import client
+
+CHUNK_SIZE = 4 * 1024
+
+
+class ThrottledHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    bandwidth = 256 * 1024
+    bytes_in = 0
+    bytes_out = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _read(self, size: int) -> bytes:
+        body = b''
+        while len(body) < size:
+            chunk = self.rfile.read(min(CHUNK_SIZE, size - len(body)))
+            time.sleep(len(chunk) / self.bandwidth)
+            body += chunk
+        ThrottledHandler.bytes_in += len(body)
+        return body
+
+    def _write(self, body: bytes, encoding: str = None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        for i in range(0, len(body), CHUNK_SIZE):
+            chunk = body[i:i + CHUNK_SIZE]
+            time.sleep(len(chunk) / self.bandwidth)
+            ThrottledHandler.bytes_out += len(chunk)
+            self.wfile.write(chunk)
+
+    def do_POST(self):
+        body = self._read(int(self.headers['Content-Length']))
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == client.COMPRESSION_GZIP:
+            body = gzip.decompress(body)
+        elif encoding == client.COMPRESSION_DEFLATE:
+            body = zlib.decompress(body)
+        json.loads(body.decode())
+        self._write(json.dumps({'Code': 'ok', 'Description': 'ok', 'Result': 1}).encode())
+
+    def do_GET(self):
+        rows = [{'State': 'Delivered', 'Price': 0, 'Id': i, 'DestinationEmail': 'user{}@example.com'.format(i),
+                 'LastUpdateUtc': '2017-08-01T00:00:00', 'CreatedDateUtc': '2017-08-01T00:00:00'}
+                for i in range(2000)]
+        body = json.dumps({'Code': 'ok', 'Description': 'ok', 'Result': rows}).encode()
+        accept_encoding = self.headers.get('Accept-Encoding', '')
+        if 'gzip' in accept_encoding:
+            self._write(gzip.compress(body), 'gzip')
+        else:
+            self._write(body)
+
+
+def make_html(size: int) -> str:
+    words = ['offer', 'discount', 'newsletter', 'campaign', 'subscribe', 'product', 'price', 'delivery']
+    rnd = random.Random(0)
+    parts = []
+    length = 0
+    while length < size:
+        row = '<tr><td class="item"><a href="https://example.com/{0}">{1}</a></td><td>{2}</td></tr>\n'.format(
+            rnd.randint(0, 10 ** 6), ' '.join(rnd.choice(words) for _ in range(6)), rnd.randint(1, 1000))
+        parts.append(row)
+        length += len(row)
+    return '<html><body><table>\n{}</table></body></html>'.format(''.join(parts))
+
+
+def run(devino: client.DevinoClient, tasks: int, html: str):
+    ThrottledHandler.bytes_in = ThrottledHandler.bytes_out = 0
+    started = time.perf_counter()
+    for i in range(tasks):
+        devino.add_task('campaign {}'.format(i), 'sender@example.com', 'Sender', 'Subject', html)
+    devino.get_state_detailing(range_end=2000)
+    elapsed = time.perf_counter() - started
+    return elapsed, ThrottledHandler.bytes_in, ThrottledHandler.bytes_out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bandwidth', type=int, default=256, help='link bandwidth, KB/s')
+    parser.add_argument('--tasks', type=int, default=5, help='number of add_task calls')
+    parser.add_argument('--html-size', type=int, default=300, help='campaign body size, KB')
+    args = parser.parse_args()
+
+    ThrottledHandler.bandwidth = args.bandwidth * 1024
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ThrottledHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}'.format(server.server_port)
+    html = make_html(args.html_size * 1024)
+
+    print('{:<10} {:>10} {:>12} {:>12}'.format('mode', 'time, s', 'sent, KB', 'received, KB'))
+    cases = (
+        ('identity', None, 'identity'),
+        ('gzip', client.COMPRESSION_GZIP, None),
+        ('deflate', client.COMPRESSION_DEFLATE, None),
+    )
+    for name, compression, accept_encoding in cases:
+        devino = client.DevinoClient('login', 'password', url=url, compression=compression,
+                                     accept_encoding=accept_encoding)
+        elapsed, bytes_in, bytes_out = run(devino, args.tasks, html)
+        print('{:<10} {:>10.2f} {:>12.1f} {:>12.1f}'.format(name, elapsed, bytes_in / 1024, bytes_out / 1024))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
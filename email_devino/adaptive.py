@@ -0,0 +1,176 @@
+import threading
+import time
+
+from .client import DevinoClient, DevinoException
+
+THROTTLING_STATUSES = (429, )
+
+
+class AimdLimiter:
+    """
+    Limits number of in-flight requests.
+    Limit grows additively while it is used and requests succeed with healthy latency
+    and is cut multiplicatively on throttling, 5xx, connection errors or rising latency.
+    """
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 64,
+                 increase: float = 1.0, decrease: float = 0.5, latency_tolerance: float = 2.0,
+                 latency_floor: float = 0.1, latency_smoothing: float = 0.1):
+        """
+        increase - limit growth per limit successful requests (i.e. per "window")
+        decrease - multiplier applied to limit on congestion
+        latency_tolerance - latency greater than usual latency of the method multiplied by this value is congestion
+        latency_floor - latency in seconds below which request is never treated as congested
+        latency_smoothing - weight of the last successful request in usual latency (exponential moving average)
+        """
+        assert 1 <= min_limit <= initial_limit <= max_limit
+        assert increase > 0
+        assert 0 < decrease < 1
+        assert 0 < latency_smoothing <= 1
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.latency_floor = latency_floor
+        self.latency_smoothing = latency_smoothing
+
+        # usual latency of successful requests by method
+        self.latency = {}
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition(threading.RLock())
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self) -> tuple:
+        """
+        Blocks until request may be sent, returns token to pass to release()
+        """
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+            # limit is only worth raising when it is actually used
+            saturated = self._in_flight >= self._limit / 2
+            return time.monotonic(), saturated
+
+    def release(self, token: tuple, congested: bool = False, failed: bool = False, key: str = None):
+        started, saturated = token
+        with self._condition:
+            self._in_flight -= 1
+            self.record(started, saturated, congested, failed, key)
+            self._condition.notify_all()
+
+    def record(self, started: float, saturated: bool, congested: bool = False, failed: bool = False,
+               key: str = None):
+        """
+        Adjusts limit by result of request started at time.monotonic() value started.
+        Used directly by PriorityScheduler, which limits requests itself.
+
+        saturated - at least half of limit was in use when request was sent
+        congested - request failed because of throttling or server/connection problems
+        failed - request failed for other reasons (e.g. 404), such requests don't change the limit
+        key - method name, latency is compared with usual latency of the same method
+        """
+        latency = time.monotonic() - started
+        with self._condition:
+            if congested or (not failed and self._is_slow(latency, key)):
+                # requests sent before the last cut already saw the old limit, don't cut again for them
+                if started >= self._last_decrease:
+                    self._limit = max(float(self.min_limit), self._limit * self.decrease)
+                    self._last_decrease = time.monotonic()
+            elif not failed and saturated:
+                self._limit = min(float(self.max_limit), self._limit + self.increase / self._limit)
+
+    @staticmethod
+    def is_congestion(ex: Exception) -> bool:
+        return is_congestion(ex)
+
+    def _is_slow(self, latency: float, key: str) -> bool:
+        """
+        Compares latency of successful request with usual latency of the method and updates the latter
+        """
+        usual = self.latency.get(key)
+        if usual is None:
+            self.latency[key] = latency
+            return False
+
+        self.latency[key] = usual + self.latency_smoothing * (latency - usual)
+        return bool(self.latency_tolerance) and latency > max(usual * self.latency_tolerance, self.latency_floor)
+
+
+class AdaptiveDevinoClient:
+    """
+    Wraps DevinoClient, public api methods called from many threads are limited by AimdLimiter
+
+    client = AdaptiveDevinoClient(DevinoClient(login, password))
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        executor.map(lambda email: client.send_transactional_message(...), emails)
+    client.limit  # current concurrency limit
+
+    If DevinoClient has PriorityScheduler, the scheduler keeps limiting requests by priority
+    and the limiter only lowers its capacity, with latency measured without time spent in the queue.
+    Limiter already set on the scheduler is reused.
+    """
+
+    def __init__(self, client: DevinoClient, limiter: AimdLimiter = None):
+        scheduler = client.scheduler
+        if scheduler is not None and scheduler.limiter is not None:
+            assert limiter is None or limiter is scheduler.limiter, 'scheduler already has another limiter'
+            limiter = scheduler.limiter
+
+        self.client = client
+        self.limiter = limiter or AimdLimiter()
+        if scheduler is not None:
+            scheduler.limiter = self.limiter
+
+    @property
+    def limit(self) -> int:
+        return self.limiter.limit
+
+    @property
+    def in_flight(self) -> int:
+        if self.client.scheduler is not None:
+            return self.client.scheduler.active
+        return self.limiter.in_flight
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name.startswith('_') or not callable(attr) or self.client.scheduler is not None:
+            return attr
+
+        def wrapper(*args, **kwargs):
+            token = self.limiter.acquire()
+            congested = failed = False
+            try:
+                return attr(*args, **kwargs)
+            except Exception as ex:
+                congested = is_congestion(ex)
+                failed = True
+                raise
+            finally:
+                self.limiter.release(token, congested, failed, key=name)
+
+        return wrapper
+
+
+def is_congestion(ex: Exception) -> bool:
+    """
+    Whether request failed because of throttling or server/connection problems
+    """
+    if not isinstance(ex, DevinoException):
+        # e.g. invalid url, these are client errors
+        return False
+    if ex.http_status is None:
+        # connection error or timeout
+        return True
+    return ex.http_status in THROTTLING_STATUSES or ex.http_status >= 500
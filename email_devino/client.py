@@ -1,7 +1,13 @@
 import base64
 import datetime
+import gzip
+import json
 import requests
 import os
+import typing
+import zlib
+
+from .scheduler import PriorityScheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 
 REST_URL = 'https://integrationapi.net/email/v1'
 SETTING_ADDRESS_SENDER = '/UserSettings/SenderAddresses'
@@ -10,6 +16,8 @@ TEMPLATE = '/Templates'
 STATE = '/Statistics'
 STATE_DETAILING = '/Statistics/Messages'
 TRANSACTIONAL_EMAIL = '/Messages'
+# longer paths first: STATE_DETAILING starts with STATE
+ENDPOINTS = (SETTING_ADDRESS_SENDER, TASK, TEMPLATE, STATE_DETAILING, STATE, TRANSACTIONAL_EMAIL)
 
 METHOD_GET = 'get'
 METHOD_POST = 'post'
@@ -18,6 +26,12 @@ METHOD_PUT = 'put'
 
 FORMAT = {'format': 'json'}
 
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_DEFLATE = 'deflate'
+COMPRESSIONS = (COMPRESSION_GZIP, COMPRESSION_DEFLATE)
+COMPRESS_MIN_SIZE = 10 * 1024
+HTTP_UNSUPPORTED_MEDIA_TYPE = 415
+
 TYPE_TASK_NORMAL = 1
 TYPE_TASK_BIRTH = 2
 TYPE_TASKS = (TYPE_TASK_NORMAL, TYPE_TASK_BIRTH)
@@ -68,43 +82,67 @@ class ApiAnswer:
 
 class DevinoClient:
 
-    def __init__(self, login: str, password: str, url: str = REST_URL):
+    def __init__(self, login: str, password: str, url: str = REST_URL, compression: str = None,
+                 compress_min_size: int = COMPRESS_MIN_SIZE, accept_encoding: str = None,
+                 scheduler: PriorityScheduler = None, timeout: float = None):
+        """
+        compression - encoding of request bodies (COMPRESSION_GZIP or COMPRESSION_DEFLATE), None disables it.
+                      If server answers 415 to compressed body, request is repeated uncompressed
+                      and compression is turned off for this client
+        compress_min_size - bodies smaller than this number of bytes are sent as is
+        accept_encoding - Accept-Encoding header value, e.g. 'identity' to receive uncompressed responses,
+                          None keeps requests default (gzip, deflate)
+        scheduler - shares connections between threads by priority. By default transactional messages go first,
+                    then other changes, then reads (statistics, task and template listings);
+                    every api method accepts priority argument to override it
+        timeout - seconds to wait for server, None waits forever.
+                  With scheduler a request holds its slot until it is answered, so set timeout
+                  to keep hung requests from taking slots of transactional messages
+        """
+        assert compression is None or compression in COMPRESSIONS
+
         self.login = login
         self.password = password
         self.url = url
-
-    def get_sender_addresses(self) -> ApiAnswer:
-        answer = self._request(SETTING_ADDRESS_SENDER, self._get_auth_header())
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+        self.accept_encoding = accept_encoding
+        self.scheduler = scheduler
+        self.timeout = timeout
+
+    def get_sender_addresses(self, priority: int = None) -> ApiAnswer:
+        answer = self._request(SETTING_ADDRESS_SENDER, self._get_auth_header(), priority=priority)
         return ApiAnswer.create(answer)
 
-    def add_sender_address(self, address: str) -> ApiAnswer:
+    def add_sender_address(self, address: str, priority: int = None) -> ApiAnswer:
         json = {
             'SenderAddress': address,
         }
-        answer = self._request(SETTING_ADDRESS_SENDER, self._get_auth_header(), json=json, method=METHOD_POST)
+        answer = self._request(SETTING_ADDRESS_SENDER, self._get_auth_header(), json=json, method=METHOD_POST,
+                               priority=priority)
         return ApiAnswer.create(answer, json)
 
-    def del_sender_address(self, address: str) -> ApiAnswer:
+    def del_sender_address(self, address: str, priority: int = None) -> ApiAnswer:
         request_path = os.path.join(SETTING_ADDRESS_SENDER, address)
-        answer = self._request(request_path, self._get_auth_header(), method=METHOD_DELETE)
+        answer = self._request(request_path, self._get_auth_header(), method=METHOD_DELETE, priority=priority)
         return ApiAnswer.create(answer, {'Address': address})
 
-    def get_tasks(self, range_start: int = 1, range_end: int = 100) -> ApiAnswer:
+    def get_tasks(self, range_start: int = 1, range_end: int = 100, priority: int = None) -> ApiAnswer:
         headers = self._get_auth_header()
         headers['Range'] = 'items={}-{}'.format(range_start, range_end)
 
-        answer = self._request(TASK, headers)
+        answer = self._request(TASK, headers, priority=priority)
         return ApiAnswer.create(answer)
 
-    def get_task(self, id_task: int) -> ApiAnswer:
+    def get_task(self, id_task: int, priority: int = None) -> ApiAnswer:
         request_path = os.path.join(TASK, str(id_task))
-        answer = self._request(request_path, self._get_auth_header())
+        answer = self._request(request_path, self._get_auth_header(), priority=priority)
         return ApiAnswer.create(answer, {'Id': id_task})
 
     def add_task(self, name: str, sender_email: str, sender_name: str, subject: str, text: str,
                  type_task: int = TYPE_TASK_NORMAL, start: datetime.datetime = None,
                  end: datetime.datetime = None, user_id: str = "", contact_list: list = None,
-                 template_id: str = "", duplicates: bool = None) -> ApiAnswer:
+                 template_id: str = "", duplicates: bool = None, priority: int = None) -> ApiAnswer:
         """
         http://docs.devinotele.com/emailhttp.html#id14
         id = 1233 # example
@@ -132,13 +170,13 @@ class DevinoClient:
             json['StartDateTime'] = start.strftime("%m/%d/%Y %H:%M:%S")
         if end:
             json['EndDateTime'] = end.strftime("%m/%d/%Y %H:%M:%S")
-        answer = self._request(TASK, self._get_auth_header(), json=json, method=METHOD_POST)
+        answer = self._request(TASK, self._get_auth_header(), json=json, method=METHOD_POST, priority=priority)
         return ApiAnswer.create(answer, json)
 
     def edit_task(self, id_task: int, name: str, sender_email: str, sender_name: str, subject: str, text: str,
                   type_task: int = TYPE_TASK_NORMAL, start: datetime.datetime = None, end: datetime.datetime = None,
                   user_id: str = "", contact_list: list = None, template_id: str = "",
-                  duplicates: bool = None) -> ApiAnswer:
+                  duplicates: bool = None, priority: int = None) -> ApiAnswer:
         assert type_task in TYPE_TASKS
 
         json = {
@@ -161,11 +199,11 @@ class DevinoClient:
         if end:
             json['EndDateTime'] = end.strftime("%m/%d/%Y %H:%M:%S")
         request_path = os.path.join(TASK, str(id_task))
-        answer = self._request(request_path, self._get_auth_header(), json=json, method=METHOD_PUT)
+        answer = self._request(request_path, self._get_auth_header(), json=json, method=METHOD_PUT, priority=priority)
         json['Id'] = id_task
         return ApiAnswer.create(answer, json)
 
-    def edit_task_status(self, id_task: int, task_state: int) -> ApiAnswer:
+    def edit_task_status(self, id_task: int, task_state: int, priority: int = None) -> ApiAnswer:
         """
         http://docs.devinotele.com/emailhttp.html#id16
         """
@@ -175,17 +213,17 @@ class DevinoClient:
             'State': task_state,
         }
         request_path = os.path.join(TASK, str(id_task), 'State')
-        answer = self._request(request_path, self._get_auth_header(), json=json, method=METHOD_PUT)
+        answer = self._request(request_path, self._get_auth_header(), json=json, method=METHOD_PUT, priority=priority)
         json['Id'] = id_task
         return ApiAnswer.create(answer, json)
 
-    def get_template(self, id_template: int) -> ApiAnswer:
+    def get_template(self, id_template: int, priority: int = None) -> ApiAnswer:
         request_path = os.path.join(TEMPLATE, str(id_template))
-        answer = self._request(request_path, self._get_auth_header())
+        answer = self._request(request_path, self._get_auth_header(), priority=priority)
         return ApiAnswer.create(answer, {'Id': id_template})
 
     def add_template(self, name: str, text: str, sender_email: str = "", sender_name: str = "",
-                     subject: str = "", user_template_id: str = "") -> ApiAnswer:
+                     subject: str = "", user_template_id: str = "", priority: int = None) -> ApiAnswer:
         json = {
             "Name": name,
             "Sender": {
@@ -196,11 +234,11 @@ class DevinoClient:
             "Text": text,
             "UserTemplateId": user_template_id,
         }
-        answer = self._request(TEMPLATE, self._get_auth_header(), json=json, method=METHOD_POST)
+        answer = self._request(TEMPLATE, self._get_auth_header(), json=json, method=METHOD_POST, priority=priority)
         return ApiAnswer.create(answer, json)
 
     def edit_template(self, id_template: int, name: str, text: str, sender_email: str = "", sender_name: str = "",
-                      subject: str = "", user_template_id: str = "") -> ApiAnswer:
+                      subject: str = "", user_template_id: str = "", priority: int = None) -> ApiAnswer:
         json = {
             "Name": name,
             "Sender": {
@@ -212,16 +250,17 @@ class DevinoClient:
             "UserTemplateId": user_template_id,
         }
         request_path = os.path.join(TEMPLATE, str(id_template))
-        answer = self._request(request_path, self._get_auth_header(), json=json, method=METHOD_PUT)
+        answer = self._request(request_path, self._get_auth_header(), json=json, method=METHOD_PUT, priority=priority)
         json['Id'] = id_template
         return ApiAnswer.create(answer, json)
 
-    def del_template(self, id_template: int) -> ApiAnswer:
+    def del_template(self, id_template: int, priority: int = None) -> ApiAnswer:
         request_path = os.path.join(TEMPLATE, str(id_template))
-        answer = self._request(request_path, self._get_auth_header(), method=METHOD_DELETE)
+        answer = self._request(request_path, self._get_auth_header(), method=METHOD_DELETE, priority=priority)
         return ApiAnswer.create(answer, {'Id': id_template})
 
-    def get_state(self, id_task: int = None, start: datetime.date = None, end: datetime.date = None) -> ApiAnswer:
+    def get_state(self, id_task: int = None, start: datetime.date = None, end: datetime.date = None,
+                  priority: int = None) -> ApiAnswer:
         params = {
             'Login': self.login,
         }
@@ -230,11 +269,12 @@ class DevinoClient:
         if start and end:
             params['StartDateTime'] = start.strftime('%Y-%m-%d')
             params['EndDateTime'] = end.strftime('%Y-%m-%d')
-        answer = self._request(STATE, self._get_auth_header(), params=params)
+        answer = self._request(STATE, self._get_auth_header(), params=params, priority=priority)
         return ApiAnswer.create(answer, params)
 
     def get_state_detailing(self, id_task: int = None, start: datetime.date = None, end: datetime.date = None,
-                            state: str = '', range_start: int = 1, range_end: int = 100) -> ApiAnswer:
+                            state: str = '', range_start: int = 1, range_end: int = 100,
+                            priority: int = None) -> ApiAnswer:
         params = {
             'State': state,
             'Login': self.login
@@ -247,12 +287,12 @@ class DevinoClient:
         headers = self._get_auth_header()
         headers['Range'] = 'items={}-{}'.format(range_start, range_end)
 
-        answer = self._request(STATE_DETAILING, headers, params=params)
+        answer = self._request(STATE_DETAILING, headers, params=params, priority=priority)
         return ApiAnswer.create(answer, params)
 
     def send_transactional_message(self, sender_email: str, sender_name: str, recipient_email: str, recipient_name: str,
                                    subject: str, text: str, user_message_id: str = "", user_campaign_id: str = "",
-                                   template_id: str = "") -> ApiAnswer:
+                                   template_id: str = "", priority: int = PRIORITY_HIGH) -> ApiAnswer:
         """
         Send single message
         """
@@ -272,13 +312,14 @@ class DevinoClient:
             "UserCampaignId": user_campaign_id,
             "TemplateId": template_id,
         }
-        answer = self._request(TRANSACTIONAL_EMAIL, self._get_auth_header(), json=json, method=METHOD_POST)
+        answer = self._request(TRANSACTIONAL_EMAIL, self._get_auth_header(), json=json, method=METHOD_POST,
+                               priority=priority)
         return ApiAnswer.create(answer, json)
 
-    def get_status_transactional_message(self, id_messages: list) -> ApiAnswer:
+    def get_status_transactional_message(self, id_messages: list, priority: int = None) -> ApiAnswer:
         request_path = os.path.join(TRANSACTIONAL_EMAIL, ','.join(id_messages))
 
-        answer = self._request(request_path, self._get_auth_header())
+        answer = self._request(request_path, self._get_auth_header(), priority=priority)
         return ApiAnswer.create(answer, {'id_{}'.format(x): id_messages[x] for x in range(len(id_messages))})
 
     def _get_auth_header(self) -> dict:
@@ -286,35 +327,101 @@ class DevinoClient:
                    'Basic {}'.format(base64.b64encode('{}:{}'.format(self.login, self.password).encode()).decode())}
         return headers
 
-    def _request(self, path, headers, params=FORMAT, json=None, method=METHOD_GET):
+    def _compress_body(self, data: dict, headers: dict) -> typing.Optional[bytes]:
+        """
+        Returns compressed json body and sets encoding headers,
+        or None if body should be sent uncompressed
+        """
+        if not self.compression or data is None:
+            return None
+
+        body = json.dumps(data).encode()
+        if len(body) < self.compress_min_size:
+            return None
+
+        if self.compression == COMPRESSION_GZIP:
+            body = gzip.compress(body)
+        else:
+            body = zlib.compress(body)
+        headers['Content-Type'] = 'application/json'
+        headers['Content-Encoding'] = self.compression
+        return body
+
+    def _request(self, path, headers, params=FORMAT, json=None, method=METHOD_GET, priority=None):
         params['format'] = 'json'
         request_url = self.url + path
+        if self.accept_encoding:
+            headers['Accept-Encoding'] = self.accept_encoding
+
+        body = self._compress_body(json, headers)
+
+        if self.scheduler is None:
+            return self._perform(request_url, headers, params, json, body, method)
+
+        if priority is None:
+            priority = PRIORITY_LOW if method == METHOD_GET else PRIORITY_NORMAL
+        with self.scheduler.slot(priority, key='{} {}'.format(method, _endpoint(path))):
+            return self._perform(request_url, headers, params, json, body, method)
+
+    def _perform(self, request_url, headers, params, json, body, method):
+        response = self._send(request_url, headers, params, json, body, method)
+        if response.status_code == HTTP_UNSUPPORTED_MEDIA_TYPE and body is not None:
+            # server doesn't accept compressed bodies, don't compress for it anymore
+            self.compression = None
+            del headers['Content-Encoding']
+            response = self._send(request_url, headers, params, json, None, method)
+
+        if response.status_code >= 400:
+            try:
+                error_description = response.json()
+            except ValueError:
+                # e.g. html page of proxy for 502
+                error_description = {}
+            error = DevinoError(
+                code=error_description.get('Code'),
+                description=error_description.get('Description'),
+            )
+            raise DevinoException(
+                message='Ошибка отправки {0}-запроса'.format(method),
+                http_status=response.status_code,
+                error=error,
+            )
+
+        return response.json()
+
+    def _send(self, request_url, headers, params, json, body, method):
+        if body is None:
+            body_kwargs = {'json': json}
+        else:
+            body_kwargs = {'data': body}
 
         try:
             if method == METHOD_GET:
-                response = requests.get(request_url, params=params, headers=headers)
+                return requests.get(request_url, params=params, headers=headers, timeout=self.timeout)
             elif method == METHOD_POST:
-                response = requests.post(request_url, json=json, params=params, headers=headers)
+                return requests.post(request_url, params=params, headers=headers, timeout=self.timeout, **body_kwargs)
             elif method == METHOD_DELETE:
-                response = requests.delete(request_url, json=json, params=params, headers=headers)
+                return requests.delete(request_url, params=params, headers=headers, timeout=self.timeout,
+                                       **body_kwargs)
             else:
-                response = requests.put(request_url, json=json, params=params, headers=headers)
+                return requests.put(request_url, params=params, headers=headers, timeout=self.timeout, **body_kwargs)
         except requests.ConnectionError as ex:
             raise DevinoException(
                 message='Ошибка соединения',
                 base_exception=ex,
             )
-
-        if 400 <= response.status_code <= 500:
-            error_description = response.json()
-            error = DevinoError(
-                code=error_description.get('Code'),
-                description=error_description.get('Description'),
-            )
+        except requests.Timeout as ex:
             raise DevinoException(
-                message='Ошибка отправки {0}-запроса'.format(method),
-                http_status=response.status_code,
-                error=error,
+                message='Превышено время ожидания ответа',
+                base_exception=ex,
             )
 
-        return response.json()
+
+def _endpoint(path: str) -> str:
+    """
+    Api endpoint of request path without ids, e.g. /Tasks for /Tasks/123
+    """
+    for endpoint in ENDPOINTS:
+        if path.startswith(endpoint):
+            return endpoint
+    return path
@@ -0,0 +1,121 @@
+import collections
+import contextlib
+import math
+import threading
+import time
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class PriorityScheduler:
+    """
+    Limits number of concurrent requests and grants free slots by priority (0 is the highest).
+    Class that is waiting for a slot is served at least once per 1/min_share grants,
+    so low priority requests are never starved.
+    """
+
+    def __init__(self, max_concurrent: int = 8, priorities: int = 3, min_share: float = 0.1, limiter=None):
+        """
+        max_concurrent - number of requests in flight
+        priorities - number of priority classes, priorities greater than the last one are treated as the last one
+        min_share - minimal share of slots granted to any waiting class, 0 disables starvation protection
+        limiter - adaptive.AimdLimiter, its limit lowers max_concurrent and it gets latency and errors
+                  of requests measured inside the slot, i.e. without time spent in the queue
+        """
+        assert max_concurrent >= 1
+        assert priorities >= 1
+        assert 0 <= min_share <= 1
+
+        self.max_concurrent = max_concurrent
+        self.priorities = priorities
+        # waiting class is served after starvation_limit grants to others, i.e. once per starvation_limit + 1,
+        # rounded down to keep at least min_share; epsilon covers float error of the division
+        self.starvation_limit = math.floor(1 / min_share + 1e-9) - 1 if min_share else None
+        self.limiter = limiter
+
+        self.granted = [0] * priorities
+        self._active = 0
+        self._waiting = [collections.deque() for _ in range(priorities)]
+        self._skipped = [0] * priorities
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def capacity(self) -> int:
+        if self.limiter is None:
+            return self.max_concurrent
+        return min(self.max_concurrent, self.limiter.limit)
+
+    def waiting(self, priority: int) -> int:
+        return len(self._waiting[self._normalize(priority)])
+
+    @contextlib.contextmanager
+    def slot(self, priority: int, key: str = None):
+        """
+        key - kind of request (e.g. method and endpoint), limiter compares latency of requests of the same kind
+        """
+        saturated = self.acquire(priority)
+        started = time.monotonic()
+        congested = failed = False
+        try:
+            yield
+        except Exception as ex:
+            failed = True
+            congested = self.limiter is not None and self.limiter.is_congestion(ex)
+            raise
+        finally:
+            if self.limiter is not None:
+                self.limiter.record(started, saturated, congested, failed, key)
+            self.release()
+
+    def acquire(self, priority: int) -> bool:
+        """
+        Blocks until slot is granted, returns whether at least half of slots were in use
+        """
+        priority = self._normalize(priority)
+        with self._lock:
+            if self._active < self.capacity and not any(self._waiting):
+                self._grant(priority)
+                return self._active >= self.capacity / 2
+            event = threading.Event()
+            self._waiting[priority].append(event)
+        event.wait()
+        return True
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            while self._active < self.capacity:
+                priority = self._next_priority()
+                if priority is None:
+                    break
+                event = self._waiting[priority].popleft()
+                self._grant(priority)
+                event.set()
+
+    def _normalize(self, priority: int) -> int:
+        return min(max(priority, 0), self.priorities - 1)
+
+    def _next_priority(self) -> int:
+        waiting = [priority for priority in range(self.priorities) if self._waiting[priority]]
+        if not waiting:
+            return None
+        if self.starvation_limit is not None:
+            for priority in waiting:
+                if self._skipped[priority] >= self.starvation_limit:
+                    return priority
+        return waiting[0]
+
+    def _grant(self, priority: int):
+        self._active += 1
+        self.granted[priority] += 1
+        for other in range(self.priorities):
+            if other != priority and self._waiting[other]:
+                self._skipped[other] += 1
+            else:
+                self._skipped[other] = 0
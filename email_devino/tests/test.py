@@ -1,8 +1,15 @@
 import datetime
+import gzip
+import json
+import threading
+import time
+import zlib
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import MagicMock, Mock, patch
 
-from .. import client
+import requests
+
+from .. import adaptive, client, scheduler
 
 
 class ApiAnswer(TestCase):
@@ -83,6 +90,141 @@ class DevinoClient(TestCase):
         self.assertEqual(exception.error.code, error_data['Code'])
         self.assertEqual(exception.error.description, error_data['Description'])
 
+    def test_request_error_not_json(self, requests_mock):
+        requests_mock.get.return_value.status_code = 502
+        requests_mock.get.return_value.json.side_effect = ValueError
+
+        with self.assertRaises(client.DevinoException) as context:
+            self.client._request('/some_url/', {'test': 123})
+
+        self.assertEqual(502, context.exception.http_status)
+        self.assertIsNone(context.exception.error.code)
+
+    def test_request_accept_encoding(self, requests_mock):
+        requests_mock.get.return_value.status_code = 200
+
+        self.client._request('/some_url/', {'test': 123})
+        call_args, call_kwargs = requests_mock.get.call_args
+        self.assertNotIn('Accept-Encoding', call_kwargs['headers'])
+
+        self.client = client.DevinoClient('test_login', 'test_passw', accept_encoding='identity')
+        self.client._request('/some_url/', {'test': 123})
+        call_args, call_kwargs = requests_mock.get.call_args
+        self.assertEqual('identity', call_kwargs['headers']['Accept-Encoding'])
+
+    def test_request_gzip(self, requests_mock):
+        requests_mock.post.return_value.status_code = 200
+        self.client = client.DevinoClient('test_login', 'test_passw', compression=client.COMPRESSION_GZIP,
+                                          compress_min_size=100)
+        data = {'Text': '<p>test</p>' * 100}
+
+        self.client._request('/some_url/', {'test': 123}, json=data, method=client.METHOD_POST)
+
+        call_args, call_kwargs = requests_mock.post.call_args
+        self.assertNotIn('json', call_kwargs)
+        self.assertEqual('gzip', call_kwargs['headers']['Content-Encoding'])
+        self.assertEqual('application/json', call_kwargs['headers']['Content-Type'])
+        self.assertEqual(data, json.loads(gzip.decompress(call_kwargs['data']).decode()))
+
+    def test_request_deflate(self, requests_mock):
+        requests_mock.put.return_value.status_code = 200
+        self.client = client.DevinoClient('test_login', 'test_passw', compression=client.COMPRESSION_DEFLATE,
+                                          compress_min_size=100)
+        data = {'Text': '<p>test</p>' * 100}
+
+        self.client._request('/some_url/', {'test': 123}, json=data, method=client.METHOD_PUT)
+
+        call_args, call_kwargs = requests_mock.put.call_args
+        self.assertEqual('deflate', call_kwargs['headers']['Content-Encoding'])
+        self.assertEqual(data, json.loads(zlib.decompress(call_kwargs['data']).decode()))
+
+    def test_request_compression_unsupported(self, requests_mock):
+        unsupported = Mock(status_code=415)
+        unsupported.json.side_effect = ValueError
+        ok = Mock(status_code=200)
+        ok.json.return_value = 'ok'
+        requests_mock.post.side_effect = [unsupported, ok]
+        self.client = client.DevinoClient('test_login', 'test_passw', compression=client.COMPRESSION_GZIP,
+                                          compress_min_size=100)
+        data = {'Text': '<p>test</p>' * 100}
+
+        response = self.client._request('/some_url/', {'test': 123}, json=data, method=client.METHOD_POST)
+
+        self.assertEqual('ok', response)
+        self.assertEqual(2, requests_mock.post.call_count)
+        call_args, call_kwargs = requests_mock.post.call_args
+        self.assertEqual(data, call_kwargs['json'])
+        self.assertNotIn('Content-Encoding', call_kwargs['headers'])
+        self.assertIsNone(self.client.compression)
+
+    def test_request_compress_min_size_in_bytes(self, requests_mock):
+        requests_mock.post.return_value.status_code = 200
+        text = 'Привет мир ' * 100
+        self.assertLess(len(text), 2000)
+        self.client = client.DevinoClient('test_login', 'test_passw', compression=client.COMPRESSION_GZIP,
+                                          compress_min_size=2000)
+
+        self.client._request('/some_url/', {'test': 123}, json={'Text': text}, method=client.METHOD_POST)
+
+        call_args, call_kwargs = requests_mock.post.call_args
+        self.assertEqual('gzip', call_kwargs['headers']['Content-Encoding'])
+        self.assertEqual({'Text': text}, json.loads(gzip.decompress(call_kwargs['data']).decode()))
+
+    def test_request_small_body_not_compressed(self, requests_mock):
+        requests_mock.post.return_value.status_code = 200
+        self.client = client.DevinoClient('test_login', 'test_passw', compression=client.COMPRESSION_GZIP,
+                                          compress_min_size=100)
+        data = {'Text': 'test'}
+
+        self.client._request('/some_url/', {'test': 123}, json=data, method=client.METHOD_POST)
+
+        call_args, call_kwargs = requests_mock.post.call_args
+        self.assertEqual(data, call_kwargs['json'])
+        self.assertNotIn('Content-Encoding', call_kwargs['headers'])
+
+    def test_request_scheduler_priority(self, requests_mock):
+        requests_mock.get.return_value.status_code = 200
+        requests_mock.post.return_value.status_code = 200
+        self.client.scheduler = MagicMock()
+
+        self.client.get_tasks()
+        self.client.scheduler.slot.assert_called_with(scheduler.PRIORITY_LOW, key='get /Tasks')
+
+        self.client.add_template('test name', 'test text')
+        self.client.scheduler.slot.assert_called_with(scheduler.PRIORITY_NORMAL, key='post /Templates')
+
+        self.client.send_transactional_message('sender', 'name', 'recipient', 'name', 'subject', 'text')
+        self.client.scheduler.slot.assert_called_with(scheduler.PRIORITY_HIGH, key='post /Messages')
+
+        self.client.get_state_detailing(id_task=1)
+        self.client.scheduler.slot.assert_called_with(scheduler.PRIORITY_LOW, key='get /Statistics/Messages')
+
+    def test_request_priority_argument(self, requests_mock):
+        requests_mock.get.return_value.status_code = 200
+        requests_mock.post.return_value.status_code = 200
+        self.client.scheduler = MagicMock()
+
+        self.client.send_transactional_message('sender', 'name', 'recipient', 'name', 'subject', 'text',
+                                               priority=scheduler.PRIORITY_NORMAL)
+        self.client.scheduler.slot.assert_called_with(scheduler.PRIORITY_NORMAL, key='post /Messages')
+
+        self.client.get_task(1, priority=5)
+        self.client.scheduler.slot.assert_called_with(5, key='get /Tasks')
+
+    def test_request_timeout(self, requests_mock):
+        requests_mock.ConnectionError = requests.ConnectionError
+        requests_mock.Timeout = requests.Timeout
+        requests_mock.get.side_effect = requests.ReadTimeout
+        self.client = client.DevinoClient('test_login', 'test_passw', timeout=5)
+
+        with self.assertRaises(client.DevinoException) as context:
+            self.client._request('/some_url/', {'test': 123})
+
+        self.assertIsNone(context.exception.http_status)
+        self.assertIsInstance(context.exception.base_exception, requests.ReadTimeout)
+        call_args, call_kwargs = requests_mock.get.call_args
+        self.assertEqual(5, call_kwargs['timeout'])
+
     def test_auth_header(self, requests_mock):
         response = self.client._get_auth_header()
 
@@ -377,3 +519,306 @@ class DevinoClient(TestCase):
 
         call_args, call_kwargs = requests_mock.get.call_args
         self.assertEqual(self.client.url + client.TRANSACTIONAL_EMAIL + '/' + id_messages[0], call_args[0])
+
+
+class AimdLimiter(TestCase):
+    def setUp(self):
+        self.limiter = adaptive.AimdLimiter(initial_limit=4, min_limit=1, max_limit=8)
+
+    def _window(self, size: int, **kwargs):
+        tokens = [self.limiter.acquire() for _ in range(size)]
+        for token in tokens:
+            self.limiter.release(token, **kwargs)
+
+    def test_additive_increase(self):
+        self._window(4)
+        self._window(4)
+
+        self.assertEqual(5, self.limiter.limit)
+        self.assertEqual(0, self.limiter.in_flight)
+
+    def test_no_increase_when_not_saturated(self):
+        for _ in range(100):
+            self._window(1)
+
+        self.assertEqual(4, self.limiter.limit)
+
+    def test_max_limit(self):
+        for _ in range(100):
+            self._window(self.limiter.limit)
+
+        self.assertEqual(8, self.limiter.limit)
+
+    def test_multiplicative_decrease(self):
+        self._window(1, congested=True)
+        self.assertEqual(2, self.limiter.limit)
+
+        self._window(1, congested=True)
+        self.assertEqual(1, self.limiter.limit)
+
+        self._window(1, congested=True)
+        self.assertEqual(1, self.limiter.limit)
+
+    def test_decrease_once_per_window(self):
+        self._window(4, congested=True)
+
+        self.assertEqual(2, self.limiter.limit)
+
+    def test_failed(self):
+        self._window(4, failed=True)
+
+        self.assertEqual(4, self.limiter.limit)
+        self.assertEqual({}, self.limiter.latency)
+
+    def test_latency_congestion(self):
+        self.limiter.latency['get_task'] = 0.1
+        started, saturated = self.limiter.acquire()
+
+        self.limiter.release((started - 1, saturated), key='get_task')
+
+        self.assertEqual(2, self.limiter.limit)
+
+    def test_latency_by_method(self):
+        self.limiter.latency['get_task'] = 0.1
+        started, saturated = self.limiter.acquire()
+
+        self.limiter.release((started - 1, saturated), key='add_task')
+
+        self.assertEqual(4, self.limiter.limit)
+        self.assertAlmostEqual(1, self.limiter.latency['add_task'], places=1)
+
+    def test_latency_baseline_adapts(self):
+        self.limiter.latency['add_task'] = 0.1
+        for _ in range(50):
+            started, saturated = self.limiter.acquire()
+            self.limiter.release((started - 1, saturated), key='add_task')
+        limit = self.limiter.limit
+
+        self._window(1)
+        started, saturated = self.limiter.acquire()
+        self.limiter.release((started - 1, saturated), key='add_task')
+
+        self.assertGreater(self.limiter.latency['add_task'], 0.9)
+        self.assertEqual(limit, self.limiter.limit)
+
+
+class AdaptiveDevinoClient(TestCase):
+    def setUp(self):
+        self.devino_client = Mock(scheduler=None)
+        self.client = adaptive.AdaptiveDevinoClient(self.devino_client,
+                                                     adaptive.AimdLimiter(initial_limit=4, max_limit=8))
+
+    def test_success(self):
+        self.devino_client.get_tasks.return_value = 'ok'
+
+        response = self.client.get_tasks(range_end=10)
+
+        self.assertEqual('ok', response)
+        self.devino_client.get_tasks.assert_called_once_with(range_end=10)
+        self.assertEqual(4, self.client.limit)
+        self.assertEqual(0, self.client.in_flight)
+
+    def test_throttling(self):
+        self.devino_client.get_tasks.side_effect = client.DevinoException('error', http_status=429)
+
+        with self.assertRaises(client.DevinoException):
+            self.client.get_tasks()
+
+        self.assertEqual(2, self.client.limit)
+        self.assertEqual(0, self.client.in_flight)
+
+    def test_client_error(self):
+        self.devino_client.get_task.side_effect = client.DevinoException('error', http_status=404)
+
+        with self.assertRaises(client.DevinoException):
+            self.client.get_task(1)
+
+        self.assertEqual(4, self.client.limit)
+        self.assertEqual({}, self.client.limiter.latency)
+
+    def test_request_exception(self):
+        self.devino_client.get_tasks.side_effect = requests.exceptions.InvalidURL
+
+        with self.assertRaises(requests.exceptions.InvalidURL):
+            self.client.get_tasks()
+
+        self.assertEqual(4, self.client.limit)
+        self.assertEqual(0, self.client.in_flight)
+
+    def test_connection_error(self):
+        self.devino_client.get_tasks.side_effect = client.DevinoException('error')
+
+        with self.assertRaises(client.DevinoException):
+            self.client.get_tasks()
+
+        self.assertEqual(2, self.client.limit)
+
+    @patch.object(client, 'requests')
+    def test_server_unavailable(self, requests_mock):
+        requests_mock.get.return_value.status_code = 503
+        requests_mock.get.return_value.json.return_value = {'Code': 'unavailable'}
+        self.client = adaptive.AdaptiveDevinoClient(client.DevinoClient('test_login', 'test_passw'),
+                                                    adaptive.AimdLimiter(initial_limit=4, max_limit=8))
+
+        with self.assertRaises(client.DevinoException) as context:
+            self.client.get_tasks()
+
+        self.assertEqual(503, context.exception.http_status)
+        self.assertEqual('unavailable', context.exception.error.code)
+        self.assertEqual(2, self.client.limit)
+
+
+class PriorityScheduler(TestCase):
+    def _run_waiters(self, priority_scheduler, priorities):
+        served = []
+
+        def request(priority):
+            with priority_scheduler.slot(priority):
+                served.append(priority)
+
+        priority_scheduler.acquire(scheduler.PRIORITY_HIGH)
+        threads = []
+        for i, priority in enumerate(priorities):
+            thread = threading.Thread(target=request, args=(priority, ))
+            thread.start()
+            threads.append(thread)
+            # wait until thread is queued to keep arrival order
+            while sum(priority_scheduler.waiting(p) for p in range(priority_scheduler.priorities)) <= i:
+                time.sleep(0.001)
+        priority_scheduler.release()
+        for thread in threads:
+            thread.join()
+        return served
+
+    def test_free_slot(self):
+        priority_scheduler = scheduler.PriorityScheduler(max_concurrent=2)
+
+        with priority_scheduler.slot(scheduler.PRIORITY_LOW):
+            with priority_scheduler.slot(scheduler.PRIORITY_LOW):
+                self.assertEqual(2, priority_scheduler.active)
+
+        self.assertEqual(0, priority_scheduler.active)
+        self.assertEqual([0, 0, 2], priority_scheduler.granted)
+
+    def test_priority_order(self):
+        priority_scheduler = scheduler.PriorityScheduler(max_concurrent=1, min_share=0)
+
+        served = self._run_waiters(priority_scheduler, [2, 1, 2, 0, 1, 0])
+
+        self.assertEqual([0, 0, 1, 1, 2, 2], served)
+
+    def test_min_share(self):
+        priority_scheduler = scheduler.PriorityScheduler(max_concurrent=1, priorities=2, min_share=0.25)
+
+        served = self._run_waiters(priority_scheduler, [1] + [0] * 7)
+
+        self.assertEqual([0, 0, 0, 1, 0, 0, 0, 0], served)
+
+    def test_min_share_rounded_down(self):
+        priority_scheduler = scheduler.PriorityScheduler(max_concurrent=1, priorities=2, min_share=0.3)
+
+        served = self._run_waiters(priority_scheduler, [1] + [0] * 7)
+
+        self.assertEqual([0, 0, 1, 0, 0, 0, 0, 0], served)
+        self.assertEqual(13, scheduler.PriorityScheduler(min_share=0.07).starvation_limit)
+        self.assertEqual(9, scheduler.PriorityScheduler(min_share=0.1).starvation_limit)
+
+    def test_priorities_count(self):
+        priority_scheduler = scheduler.PriorityScheduler(max_concurrent=1, priorities=2, min_share=0)
+
+        served = self._run_waiters(priority_scheduler, [5, 0])
+
+        self.assertEqual([0, 5], served)
+        self.assertEqual([2, 1], priority_scheduler.granted)
+
+
+class AdaptiveScheduledDevinoClient(TestCase):
+    def setUp(self):
+        self.limiter = adaptive.AimdLimiter(initial_limit=1, max_limit=8)
+        self.scheduler = scheduler.PriorityScheduler(min_share=0)
+        self.devino_client = client.DevinoClient('test_login', 'test_passw', scheduler=self.scheduler)
+        self.client = adaptive.AdaptiveDevinoClient(self.devino_client, self.limiter)
+
+    def test_capacity(self):
+        self.assertIs(self.limiter, self.scheduler.limiter)
+        self.assertEqual(1, self.scheduler.capacity)
+
+        self.limiter._limit = 3.0
+        self.assertEqual(3, self.scheduler.capacity)
+
+        # limiter doesn't exceed slots of the scheduler
+        self.limiter._limit = 20.0
+        self.assertEqual(self.scheduler.max_concurrent, self.scheduler.capacity)
+
+    def test_scheduler_limiter_reused(self):
+        adaptive_client = adaptive.AdaptiveDevinoClient(self.devino_client)
+
+        self.assertIs(self.limiter, adaptive_client.limiter)
+        self.assertIs(self.limiter, self.scheduler.limiter)
+
+    def test_scheduler_limiter_conflict(self):
+        with self.assertRaises(AssertionError):
+            adaptive.AdaptiveDevinoClient(self.devino_client, adaptive.AimdLimiter())
+
+    @patch.object(client, 'requests')
+    def test_priority(self, requests_mock):
+        served = []
+        release = threading.Event()
+
+        def get(url, **kwargs):
+            release.wait()
+            served.append(url)
+            return Mock(status_code=200)
+
+        def post(url, **kwargs):
+            served.append(url)
+            return Mock(status_code=200)
+
+        requests_mock.get.side_effect = get
+        requests_mock.post.side_effect = post
+        # keep single slot, so requests are sent one by one
+        self.limiter.max_limit = 1
+
+        threads = [threading.Thread(target=self.client.get_task, args=(i, )) for i in range(3)]
+        threads.append(threading.Thread(target=self.client.send_transactional_message,
+                                        args=('sender', 'name', 'recipient', 'name', 'subject', 'text')))
+        for i, thread in enumerate(threads):
+            thread.start()
+            while self.client.in_flight + sum(self.scheduler.waiting(p) for p in range(3)) <= i:
+                time.sleep(0.001)
+        self.assertEqual(1, self.client.in_flight)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        # first read was already sent, transactional message goes before other reads
+        self.assertEqual(self.devino_client.url + client.TRANSACTIONAL_EMAIL, served[1])
+
+    @patch.object(client, 'requests')
+    def test_queue_time_not_latency(self, requests_mock):
+        requests_mock.get.return_value.status_code = 200
+        self.limiter.latency['get /Tasks'] = 0.001
+        self.limiter._limit = 2.0
+
+        self.scheduler.acquire(scheduler.PRIORITY_HIGH)
+        self.scheduler.acquire(scheduler.PRIORITY_HIGH)
+        thread = threading.Thread(target=self.client.get_task, args=(1, ))
+        thread.start()
+        time.sleep(0.3)
+        self.scheduler.release()
+        thread.join()
+        self.scheduler.release()
+
+        self.assertGreaterEqual(self.limiter.limit, 2)
+        self.assertLess(self.limiter.latency['get /Tasks'], 0.1)
+
+    @patch.object(client, 'requests')
+    def test_server_unavailable(self, requests_mock):
+        requests_mock.get.return_value.status_code = 503
+        self.limiter._limit = 4.0
+
+        with self.assertRaises(client.DevinoException):
+            self.client.get_tasks()
+
+        self.assertEqual(2, self.client.limit)
+        self.assertEqual(0, self.client.in_flight)